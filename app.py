@@ -5,12 +5,17 @@ import os
 from openai import OpenAI
 from embedchain import App as EmbedchainApp
 import io
-from pypdf import PdfReader
+from pdf_text import extract_pdf_text
 import re
+import hashlib
+import json
+import diskcache
+import charset_normalizer
 from streamlit_authenticator import Authenticate
 import yaml
 from yaml.loader import SafeLoader
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -22,12 +27,101 @@ if not OPENAI_API_KEY:
     st.error("Please set your OpenAI API key in the .env file.")
     st.stop()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+LLM_MODEL = "gpt-4o-mini"
+LLM_MAX_WORKERS = 16  # Concurrent OpenAI requests when generating notes
+QA_TOP_K = 4  # Note chunks retrieved per question
+PDF_TOP_K = 4  # Textbook chunks retrieved per slide
+MIN_PDF_TEXT_CHARS = 500  # Below this the PDF is treated as scanned images
+NOTES_JOB_WORKERS = 4  # Notes-generation jobs running at once across all users
+NOTES_POLL_INTERVAL = 1.0  # Seconds between reruns while a notes job is running
+LESSON_PLAN_ARROW_RE = re.compile(r'\s*->\s*')  # Level separator in the lesson plan text
+
+# --- Prompt Templates ---
+SLIDE_PROMPT_TEMPLATE = """Generate detailed content for a slide on the topic: '{topic}', subtopic: '{subtopic}', sub-subtopic: '{sub_subtopic}' for a {difficulty_level} level course. 
+            Include relevant explanations, examples, and details suitable for comprehensive understanding.
+            Also write a descriptive prompt for an image representing this slide.
+            Respond with a JSON object with exactly two string keys: "slide" (the slide content) and "image_prompt"."""
+
+
+# --- Cached Helpers ---
+@st.cache_resource
+def get_client():
+    """Returns one OpenAI client per server process so its connection pool stays warm."""
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+
+@st.cache_resource
+def get_llm_cache():
+    """Returns the on-disk cache of LLM replies, shared by every session."""
+    return diskcache.Cache(".llm_cache")
+
+
+@st.cache_resource
+def get_notes_jobs():
+    """Returns the process-wide registry of running notes jobs, keyed by username."""
+    return {}
+
+
+@st.cache_resource
+def get_job_executor():
+    """Returns the pool that runs notes generation off the Streamlit script thread."""
+    return ThreadPoolExecutor(max_workers=NOTES_JOB_WORKERS)
+
+
+@st.cache_resource(show_spinner=False)
+def build_text_index(text):
+    """Embeds a text once, in its own collection, so prompts only pull the relevant chunks."""
+    collection_name = "text_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    index = EmbedchainApp.from_config(config={
+        "vectordb": {"provider": "chroma", "config": {"collection_name": collection_name}}})
+    index.add(text, data_type="text")
+    return index
+
+
+@st.cache_data(show_spinner=False)
+def decode_text_file(raw):
+    """Decodes an uploaded text file, detecting its encoding instead of assuming UTF-8."""
+    encoding = charset_normalizer.detect(raw)["encoding"] or "utf-8"
+    return raw.decode(encoding, errors="replace")
+
+
+@st.cache_data(show_spinner=False)
+def get_config(path='./config.yaml'):
+    """Loads the auth config once; cache_data hands each session its own copy."""
+    with open(path) as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+
+@st.cache_data(show_spinner=False)
+def _extract_pdf(pdf_bytes):
+    """Extracts the text of a PDF, cached on its bytes so reruns skip the parse."""
+    return extract_pdf_text(pdf_bytes)
+
+
+client = get_client()
+llm_cache = get_llm_cache()
+
+
+def _chat(prompt, **kwargs):
+    """Sends a single-turn chat completion and returns the stripped reply text.
+
+    Replies are cached on disk by model, prompt and generation settings, so
+    re-running with identical inputs skips the API call.
+    """
+    key = hashlib.sha256(f"{LLM_MODEL}|{prompt}|{sorted(kwargs.items())}".encode("utf-8")).hexdigest()
+    reply = llm_cache.get(key)
+    if reply is not None:
+        return reply
+    response = client.chat.completions.create(model=LLM_MODEL, messages=[{"role": "user", "content": prompt}],
+                                              **kwargs)
+    reply = response.choices[0].message.content.strip()
+    llm_cache.set(key, reply)
+    return reply
+
 
 # --- Authentication ---
 try:
-    with open('./config.yaml') as file:
-        config = yaml.load(file, Loader=SafeLoader)
+    config = get_config()
 except FileNotFoundError:
     st.error("Error: config.yaml not found. Please create one based on the example.")
     st.stop()
@@ -35,13 +129,16 @@ except yaml.YAMLError as e:
     st.error(f"Error parsing config.yaml: {e}")
     st.stop()
 
-authenticator = Authenticate(
-    config['credentials'],
-    config['cookie']['name'],
-    config['cookie']['key'],
-    config['cookie']['expiry_days'],
-    config['preauthorized']
-)
+# The authenticator keeps per-session cookie state, so build it once per session
+if 'authenticator' not in st.session_state:
+    st.session_state.authenticator = Authenticate(
+        config['credentials'],
+        config['cookie']['name'],
+        config['cookie']['key'],
+        config['cookie']['expiry_days'],
+        config['preauthorized']
+    )
+authenticator = st.session_state.authenticator
 
 # Check for preauthorized users
 if 'name' not in st.session_state:
@@ -91,111 +188,134 @@ if st.session_state.authentication_status:
 
             Ensure the plan is comprehensive and covers all aspects of the syllabus at the specified difficulty level."""
         try:
-            response = client.completions.create(model="gpt-3.5-turbo-instruct", prompt=prompt, max_tokens=max_tokens,
-                                                temperature=temperature)
-            return response.choices[0].text.strip()
+            return _chat(prompt, max_tokens=max_tokens, temperature=temperature)
         except Exception as e:
             st.error(f"Error generating lesson plan: {e}")
             return None
 
-    def create_docx_from_text(text, filename="lesson_plan.docx"):
+    def create_docx_from_text(text):
         document = Document()
         document.add_paragraph(text)
-        document.save(filename)
-        return filename
+        buffer = io.BytesIO()
+        document.save(buffer)
+        return buffer.getvalue()
 
-    def generate_slide_content(topic, subtopic, sub_subtopic, difficulty_level, pdf_content=None, temperature=0.8,
+    def generate_slide_content(topic, subtopic, sub_subtopic, difficulty_level, pdf_index=None, temperature=0.8,
                                max_tokens=1500):
-        prompt = f"""Generate detailed content for a slide on the topic: '{topic}', subtopic: '{subtopic}', sub-subtopic: '{sub_subtopic}' for a {difficulty_level} level course. 
-            Include relevant explanations, examples, and details suitable for comprehensive understanding."""
-        context_str = f"\nConsider the following information:\n{pdf_content}" if pdf_content else ""
+        """Generates a slide and its image prompt in one call; returns (content, image_prompt)."""
+        prompt = SLIDE_PROMPT_TEMPLATE.format_map({"topic": topic, "subtopic": subtopic, "sub_subtopic": sub_subtopic,
+                                                   "difficulty_level": difficulty_level})
         try:
-            response = client.completions.create(model="gpt-3.5-turbo-instruct", prompt=prompt + context_str,
-                                                max_tokens=max_tokens, temperature=temperature)
-            return response.choices[0].text.strip()
+            context_str = ""
+            if pdf_index:
+                # Only the textbook passages relevant to this slide, not the whole book
+                results = pdf_index.search(f"{topic} {subtopic} {sub_subtopic}", num_documents=PDF_TOP_K)
+                pdf_context = "\n\n".join(result["context"] for result in results)
+                context_str = f"\nConsider the following information:\n{pdf_context}"
+            reply = json.loads(_chat(prompt + context_str, max_tokens=max_tokens, temperature=temperature,
+                                     response_format={"type": "json_object"}))
+            return reply.get("slide", "").strip() or None, reply.get("image_prompt", "").strip() or None
         except Exception as e:
             st.error(f"Error generating slide content: {e}")
-            return None
+            return None, None
 
-    def generate_image_prompt(topic, subtopic, sub_subtopic, temperature=0.7, max_tokens=100):
-        prompt = f"Generate a descriptive prompt for an image representing the topic: '{topic}', subtopic: '{subtopic}', sub-subtopic: '{sub_subtopic}'."
-        try:
-            response = client.completions.create(model="gpt-3.5-turbo-instruct", prompt=prompt, max_tokens=max_tokens,
-                                                temperature=temperature)
-            return response.choices[0].text.strip()
-        except Exception as e:
-            st.warning(f"Could not generate image prompt: {e}")
-            return None
+    def create_detailed_notes_docx(lesson_plan_structure, difficulty_level, pdf_index=None, progress=None):
+        """Returns the notes as DOCX bytes together with their plain text (used for QA).
 
-    def create_detailed_notes_docx(lesson_plan_structure, difficulty_level, pdf_content=None):
+        Runs as a background job, so it must not touch Streamlit elements; slide
+        counts are reported through the optional ``progress`` dict instead.
+        """
+        if progress is None:
+            progress = {}
         document = Document()
         document.add_heading("Detailed Course Notes", level=1)
-        total_slides = sum(
-            len(subtopics.get(subtopic, [])) if isinstance(subtopics, dict) else 1 for topic, subtopics in
-            lesson_plan_structure.items())
-        progress_bar = st.progress(0)
-        slide_count = 0
+        notes_parts = []
+
+        # Phase 1: collect every slide up front so the LLM calls can run together
+        jobs = []
         for topic, subtopics in lesson_plan_structure.items():
-            with st.expander(f"Topic: {topic}", expanded=True):
-                st.info(f"Generating content for: {topic}")
-                document.add_heading(topic, level=2)
-                if isinstance(subtopics, dict):
-                    for subtopic, sub_subtopics in subtopics.items():
-                        document.add_heading(subtopic, level=3)
-                        for sub_subtopic in sub_subtopics:
-                            slide_content = generate_slide_content(topic, subtopic, sub_subtopic, difficulty_level,
-                                                                   pdf_content)
-                            if slide_content:
-                                document.add_heading(sub_subtopic, level=4)
-                                paragraph = document.add_paragraph(slide_content)
-                                paragraph_format = paragraph.paragraph_format
-                                paragraph_format.space_before = Pt(6)
-                                paragraph_format.space_after = Pt(6)
-                                image_prompt = generate_image_prompt(topic, subtopic, sub_subtopic)
-                                if image_prompt:
-                                    document.add_paragraph(f"**Image Prompt:** {image_prompt}", style='Intense Quote')
-                            slide_count += 1
-                            progress_bar.progress(slide_count / total_slides if total_slides > 0 else 1.0)
-                else:
-                    slide_content = generate_slide_content(topic, "", "", difficulty_level, pdf_content)
-                    if slide_content:
-                        document.add_paragraph(slide_content)
-                    slide_count += 1
-                    progress_bar.progress(slide_count / total_slides if total_slides > 0 else 1.0)
-        filename = "detailed_notes.docx"
-        document.save(filename)
-        return filename
+            if isinstance(subtopics, dict):
+                for subtopic, sub_subtopics in subtopics.items():
+                    for sub_subtopic in sub_subtopics:
+                        jobs.append((topic, subtopic, sub_subtopic))
+            else:
+                jobs.append((topic, "", ""))
+
+        # Phase 2: the calls are network-bound, so dispatch them concurrently.
+        # Repeated slide paths (e.g. "Introduction" under the same topic twice) share one request.
+        memo = {}
+        slide_futures = []
+        with ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS) as executor:
+            for topic, subtopic, sub_subtopic in jobs:
+                key = (topic.lower().strip(), subtopic.lower().strip(), sub_subtopic.lower().strip())
+                if key not in memo:
+                    memo[key] = executor.submit(generate_slide_content, topic, subtopic, sub_subtopic,
+                                                difficulty_level, pdf_index)
+                slide_futures.append(memo[key])
+            progress["total"] = len(memo)
+            progress["done"] = 0
+            for slide_count, _ in enumerate(as_completed(memo.values()), start=1):
+                progress["done"] = slide_count
+        results = iter(slide_futures)
+
+        # Phase 3: python-docx is not thread-safe, so build the document here in order
+        for topic, subtopics in lesson_plan_structure.items():
+            document.add_heading(topic, level=2)
+            notes_parts.append(topic)
+            if isinstance(subtopics, dict):
+                for subtopic, sub_subtopics in subtopics.items():
+                    document.add_heading(subtopic, level=3)
+                    notes_parts.append(subtopic)
+                    for sub_subtopic in sub_subtopics:
+                        slide_content, image_prompt = next(results).result()
+                        if slide_content:
+                            document.add_heading(sub_subtopic, level=4)
+                            notes_parts.extend((sub_subtopic, slide_content))
+                            paragraph = document.add_paragraph(slide_content)
+                            paragraph_format = paragraph.paragraph_format
+                            paragraph_format.space_before = Pt(6)
+                            paragraph_format.space_after = Pt(6)
+                            if image_prompt:
+                                document.add_paragraph(f"**Image Prompt:** {image_prompt}", style='Intense Quote')
+            else:
+                slide_content, _ = next(results).result()
+                if slide_content:
+                    document.add_paragraph(slide_content)
+                    notes_parts.append(slide_content)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        return buffer.getvalue(), "\n\n".join(notes_parts)
 
     def extract_text_from_pdf(pdf_file):
         text = ""
         try:
-            pdf_reader = PdfReader(pdf_file)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
+            text = _extract_pdf(pdf_file.getvalue())
         except Exception as e:
             st.error(f"Error extracting text from PDF: {e}")
+            return text
+        if len(text.strip()) < MIN_PDF_TEXT_CHARS:
+            st.warning("PDF appears to be scanned images; text extraction yielded little content. Consider OCR.")
+            return None
         return text
 
+    @st.cache_data(show_spinner=False)
     def parse_lesson_plan(lesson_plan_text):
         lesson_plan_structure = {}
         current_topic = None
         current_subtopic = None
-        for line in lesson_plan_text.strip().split('\n'):
+        for line in lesson_plan_text.splitlines():
             line = line.strip()
             if not line: continue
-            if "->" not in line:
-                current_topic = line
+            parts = LESSON_PLAN_ARROW_RE.split(line)
+            if len(parts) == 1:
+                current_topic = parts[0]
                 lesson_plan_structure[current_topic] = {}
                 current_subtopic = None
-            elif line.count("->") == 1:
-                topic, subtopic = map(str.strip, line.split("->"))
-                if topic == current_topic:
-                    lesson_plan_structure[current_topic][subtopic] = []
-                    current_subtopic = subtopic
-            elif line.count("->") == 2:
-                topic, subtopic, sub_subtopic = map(str.strip, line.split("->"))
-                if topic == current_topic and subtopic == current_subtopic:
-                    lesson_plan_structure[current_topic][subtopic].append(sub_subtopic)
+            elif len(parts) == 2 and parts[0] == current_topic:
+                current_subtopic = parts[1]
+                lesson_plan_structure[current_topic][current_subtopic] = []
+            elif len(parts) == 3 and parts[0] == current_topic and parts[1] == current_subtopic:
+                lesson_plan_structure[current_topic][current_subtopic].append(parts[2])
         return lesson_plan_structure
     # --- Streamlit UI ---
     # App logic moved inside the authentication check
@@ -213,7 +333,7 @@ if st.session_state.authentication_status:
     llm_max_tokens_plan = st.slider("LLM Max Tokens (Plan)", 500, 2000, 1000, step=100,
                                     help="Maximum length of the generated lesson plan.")
     if uploaded_syllabus:
-        syllabus_text = uploaded_syllabus.read().decode("utf-8")
+        syllabus_text = decode_text_file(uploaded_syllabus.getvalue())
         if st.button("Generate Initial Lesson Plan"):
             with st.spinner("Generating initial lesson plan..."):
                 initial_lesson_plan = generate_lesson_plan(syllabus_text, difficulty_level, llm_temperature_plan,
@@ -228,9 +348,9 @@ if st.session_state.authentication_status:
     if st.button("Save Edited Lesson Plan"):
         try:
             st.session_state.lesson_plan_structure = parse_lesson_plan(edited_lesson_plan_text)
-            lesson_plan_filename = create_docx_from_text(edited_lesson_plan_text, "final_lesson_plan.docx")
-            with open(lesson_plan_filename, "rb") as f:
-                st.download_button(label="Download Lesson Plan (DOCX)", data=f, file_name=lesson_plan_filename)
+            lesson_plan_docx = create_docx_from_text(edited_lesson_plan_text)
+            st.download_button(label="Download Lesson Plan (DOCX)", data=lesson_plan_docx,
+                               file_name="final_lesson_plan.docx")
             st.success("Lesson plan saved and parsed!")
         except Exception as e:
             st.error(f"Error parsing or saving lesson plan: {e}")
@@ -243,33 +363,49 @@ if st.session_state.authentication_status:
     llm_max_tokens_notes = st.slider("LLM Max Tokens (Notes)", 500, 2500, 1500, step=100,
                                      help="Maximum length of the generated notes for each section.")
 
+    notes_jobs = get_notes_jobs()
     if st.session_state.get("lesson_plan_structure"):
-        if st.button("Generate Detailed Notes"):
-            pdf_content = None
+        if st.button("Generate Detailed Notes", disabled=st.session_state.username in notes_jobs):
+            pdf_index = None
             if uploaded_book:
                 with st.spinner("Extracting text from PDF..."):
                     pdf_content = extract_text_from_pdf(uploaded_book)
-            with st.spinner("Generating detailed notes..."):
-                notes_filename = create_detailed_notes_docx(st.session_state.lesson_plan_structure,
-                                                            difficulty_level, pdf_content)
-                st.session_state.notes_filename = notes_filename
-                with open(notes_filename, "rb") as f:
-                    st.download_button(label="Download Detailed Notes (DOCX)", data=f, file_name=notes_filename)
+                if pdf_content:
+                    with st.spinner("Indexing textbook..."):
+                        try:
+                            pdf_index = build_text_index(pdf_content)
+                        except Exception as e:
+                            st.error(f"Error indexing textbook: {e}")
+            # Generation runs in the background so reruns don't cancel it and the UI stays responsive
+            progress = {"done": 0, "total": 0}
+            future = get_job_executor().submit(create_detailed_notes_docx, st.session_state.lesson_plan_structure,
+                                               difficulty_level, pdf_index, progress)
+            notes_jobs[st.session_state.username] = {"future": future, "progress": progress}
+
+        notes_job = notes_jobs.get(st.session_state.username)
+        if notes_job and not notes_job["future"].done():
+            progress = notes_job["progress"]
+            st.progress(progress["done"] / progress["total"] if progress["total"] else 0.0,
+                        text=f"Generating detailed notes... ({progress['done']}/{progress['total']} slides)")
+            time.sleep(NOTES_POLL_INTERVAL)
+            st.rerun()
+        elif notes_job:
+            del notes_jobs[st.session_state.username]
+            try:
+                st.session_state.notes_docx, st.session_state.notes_content = notes_job["future"].result()
                 st.success("Detailed notes generated and ready for download!")
+            except Exception as e:
+                st.error(f"Error generating detailed notes: {e}")
+
+        if st.session_state.get("notes_docx"):
+            st.download_button(label="Download Detailed Notes (DOCX)", data=st.session_state.notes_docx,
+                               file_name="detailed_notes.docx")
     else:
         st.warning("Please generate and save the lesson plan first.")
 
     # --- Step 4: Ask Questions from Notes ---
     st.header("Step 4: Ask Questions from Notes")
-    if st.session_state.get("notes_filename"):
-        try:
-            with open(st.session_state.notes_filename, "r", encoding="utf-8", errors='ignore') as f:
-                notes_content = f.read()
-                st.session_state.notes_content = notes_content  # Store for highlighting
-        except Exception as e:
-            notes_content = "Could not load notes for question answering."
-            st.error(f"Error loading notes: {e}")
-
+    if st.session_state.get("notes_content"):
         notes_content_display = st.text_area("Review Notes",
                                               value=st.session_state.notes_content if 'notes_content' in st.session_state else "Generate notes to view.",
                                               height=200)
@@ -282,13 +418,24 @@ if st.session_state.authentication_status:
         if st.button("Get Answer"):
             if question and 'notes_content' in st.session_state:
                 with st.spinner("Getting answer..."):
-                    prompt = f"Answer the following question based on the notes:\n\nNotes:\n{st.session_state.notes_content}\n\nQuestion: {question}"
                     try:
-                        response = client.completions.create(model="gpt-3.5-turbo-instruct", prompt=prompt,
-                                                            max_tokens=llm_max_tokens_qa,
-                                                            temperature=llm_temperature_qa)
+                        index = build_text_index(st.session_state.notes_content)
+                        relevant_notes = "\n\n".join(
+                            result["context"] for result in index.search(question, num_documents=QA_TOP_K))
+                        prompt = f"Answer the following question based on the notes:\n\nNotes:\n{relevant_notes}\n\nQuestion: {question}"
+                        stream = client.chat.completions.create(model=LLM_MODEL,
+                                                               messages=[{"role": "user", "content": prompt}],
+                                                               max_tokens=llm_max_tokens_qa,
+                                                               temperature=llm_temperature_qa, stream=True)
                         st.write("Answer:")
-                        st.write(response.choices[0].text.strip())
+                        # Render tokens as they arrive instead of waiting for the full answer
+                        placeholder = st.empty()
+                        answer_parts = []
+                        for chunk in stream:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                answer_parts.append(chunk.choices[0].delta.content)
+                                placeholder.write("".join(answer_parts))
+                        placeholder.write("".join(answer_parts).strip())
                     except Exception as e:
                         st.error(f"Error answering question: {e}")
             elif not 'notes_content' in st.session_state:
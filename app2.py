@@ -10,8 +10,18 @@ import yaml
 from yaml.loader import SafeLoader
 import time
 from dotenv import load_dotenv
-import json
+import orjson
+import asyncio
+from collections import ChainMap, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import diskcache
+import charset_normalizer
+import tenacity
+from google.api_core import exceptions as google_exceptions
+from functools import lru_cache
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT, WD_TAB_ALIGNMENT, WD_TAB_LEADER
+from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Inches
 
 # --- Load Environment Variables ---
@@ -23,15 +33,186 @@ if not GOOGLE_API_KEY:
     st.error("Please set your Google API key in the .env file.")
     st.stop()
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
+genai.configure(api_key=GOOGLE_API_KEY, transport="grpc")  # gRPC keeps one pooled HTTP/2 channel
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+@st.cache_resource
+def get_model(system_instruction=None):
+    """
+    Returns the model for the given system instruction. Built once per process and reused
+    across Streamlit reruns, which re-execute this module on every interaction.
+    """
+    return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
+
+GEMINI_MAX_ATTEMPTS = 5  # Tries per Gemini call before the error is surfaced
+RETRYABLE_GEMINI_ERRORS = (
+    google_exceptions.ResourceExhausted,  # 429
+    google_exceptions.ServiceUnavailable,  # 503
+    google_exceptions.DeadlineExceeded,
+)
+gemini_retry = tenacity.retry(
+    wait=tenacity.wait_exponential(multiplier=1, min=1, max=30),
+    stop=tenacity.stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+    retry=tenacity.retry_if_exception_type(RETRYABLE_GEMINI_ERRORS),
+    reraise=True,
+)
+
+@gemini_retry
+def _llm_call(prompt, system_instruction=None, **cfg):
+    """Calls Gemini with the given GenerationConfig fields, retrying transient failures with exponential backoff."""
+    return get_model(system_instruction).generate_content(
+        prompt, generation_config=genai.types.GenerationConfig(**cfg)
+    )
+
+@gemini_retry
+async def _llm_call_async(prompt, system_instruction=None, **cfg):
+    """Async counterpart of _llm_call, used by the lesson plan and notes generation."""
+    return await get_model(system_instruction).generate_content_async(
+        prompt, generation_config=genai.types.GenerationConfig(**cfg)
+    )
+
+DEBUG = bool(os.getenv("DEBUG"))  # Logs cache hits to the console
+
+GEMINI_MAX_CONCURRENCY = 8  # Concurrent Gemini requests while generating the lesson plan or notes
+SIBLING_BATCH_SIZE = 8  # Sibling chunks generated together in one Gemini call
+NOTES_BATCH_SIZE = 4  # Leaf topics whose notes are generated together in one Gemini call
+
+# --- Token Budgets ---
+ROADMAP_MAX_OUTPUT_TOKENS = 2048
+LECTURE_NOTES_MAX_OUTPUT_TOKENS = 4096
+GEMINI_MAX_OUTPUT_TOKENS = 8192  # Hard output limit of the model
+LESSON_PLAN_DEPTH_TOKENS = {1: 800, 2: 500}  # Per-chunk output budget by depth
+LESSON_PLAN_LEAF_TOKENS = 250  # Budget for chunks deeper than the table above
+PARENT_CONTEXT_MAX_CHARS = 200  # Parent descriptions are only context, so keep them short
+
+def lesson_plan_token_budget(depth):
+    """Returns the max output tokens for a lesson-plan chunk at the given depth."""
+    return LESSON_PLAN_DEPTH_TOKENS.get(depth, LESSON_PLAN_LEAF_TOKENS)
+
+def _truncate_ctx(ctx, n=PARENT_CONTEXT_MAX_CHARS):
+    """Returns the parent context with each value cut to at most n characters."""
+    return {key: str(value)[:n] for key, value in ctx.items()}
 
 # --- Caching ---
-generation_cache = {}  # Simple dictionary for caching
+@st.cache_resource
+def get_generation_cache():
+    """Returns the exact-match generation cache, persisted on disk across reruns and sessions."""
+    return diskcache.Cache(".generation_cache")
+
+generation_cache = get_generation_cache()
+REDIS_URL = os.getenv("REDIS_URL")  # Enables the persistent semantic cache when set
+SEMANTIC_CACHE_DISTANCE = 0.05  # Max vector distance between prompts for a semantic cache hit
+SEMANTIC_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds a semantically cached generation stays valid
+SUBTREE_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds a generated lesson plan subtree stays valid
+NOTES_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds cached lecture notes stay valid
+NOTES_CACHE_MAX_TEMPERATURE = 0.3  # Notes sampled hotter than this are meant to vary, so they are never cached
+
+def embed_prompt(text):
+    """Embeds a prompt for semantic cache lookups."""
+    return genai.embed_content(model="models/text-embedding-004", content=text)["embedding"]
+
+@st.cache_resource
+def get_semantic_cache():
+    """
+    Returns a Redis-backed semantic cache shared across sessions, or None when REDIS_URL
+    is unset or redisvl is unavailable. Entries are tagged with a scope (e.g. the topic id)
+    so prompts that only differ by topic never match each other.
+    """
+    if not REDIS_URL:
+        return None
+    try:
+        from redisvl.extensions.llmcache import SemanticCache
+        from redisvl.utils.vectorize import CustomTextVectorizer
+        return SemanticCache(
+            name="gemini_generations",
+            redis_url=REDIS_URL,
+            vectorizer=CustomTextVectorizer(embed_prompt),
+            distance_threshold=SEMANTIC_CACHE_DISTANCE,
+            ttl=SEMANTIC_CACHE_TTL,
+            filterable_fields=[{"name": "scope", "type": "tag"}],
+        )
+    except Exception as e:
+        print(f"Semantic cache disabled: {e}")  # Debugging
+        return None
+
+def prompt_key(prompt):
+    """Returns a short fixed-size cache key for a (multi-KB) prompt."""
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+
+def subtree_key(subject, difficulty_level, topic_data, parent_topics_content, depth):
+    """
+    Returns a stable cache key for a roadmap subtree. The topic dict includes its children,
+    so any edit below the topic changes the key while untouched siblings keep theirs.
+    """
+    payload = orjson.dumps({
+        "subject": subject,
+        "difficulty": difficulty_level,
+        "topic": topic_data,
+        "parent": parent_topics_content,
+        "depth": depth,
+    }, option=orjson.OPT_SORT_KEYS)
+    return "subtree:" + hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def subtree_complete(topic_json):
+    """Returns True when every chunk in a generated subtree has content (i.e. no call failed)."""
+    return bool(topic_json["content"]) and all(subtree_complete(child) for child in topic_json["children"])
+
+def get_cached_generation(prompt, scope="text"):
+    """Returns a cached generation for the prompt (exact match, then semantic match) or None."""
+    key = prompt_key(prompt)
+    cached = generation_cache.get(key)
+    if cached is not None:
+        return cached
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        try:
+            from redisvl.query.filter import Tag
+            hits = semantic_cache.check(prompt=prompt, num_results=1, filter_expression=Tag("scope") == scope)
+            if hits:
+                generation_cache[key] = hits[0]["response"]
+                return hits[0]["response"]
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")  # Debugging
+    return None
+
+def cache_generation(prompt, response, scope="text", expire=None):
+    """Stores a generation in the exact-match cache and, when enabled, the semantic cache."""
+    generation_cache.set(prompt_key(prompt), response, expire=expire)
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        try:
+            semantic_cache.store(prompt=prompt, response=response, filters={"scope": scope})
+        except Exception as e:
+            print(f"Semantic cache store failed: {e}")  # Debugging
 
 # --- Helper Functions ---
 # --- Helper Functions ---
 
+def throttled_progress(total):
+    """
+    Creates a progress bar and returns a function that advances it by n items. The bar is only
+    redrawn when the integer percentage changes, so large plans don't flood the frontend.
+    """
+    progress_bar = st.progress(0)
+    done = 0
+    last_pct = 0
+
+    def advance(n=1):
+        nonlocal done, last_pct
+        done += n
+        pct = min(int(100 * done / max(total, 1)), 100)
+        if pct != last_pct:
+            last_pct = pct
+            progress_bar.progress(pct / 100)
+
+    return advance
+
+@st.cache_data(show_spinner=False)
+def decode_text_file(raw):
+    """Decodes an uploaded text file once per distinct upload, detecting its encoding instead of assuming UTF-8."""
+    encoding = charset_normalizer.detect(raw)["encoding"] or "utf-8"
+    return raw.decode(encoding, errors="replace")
+
 def generate_roadmap(subject, syllabus_text, difficulty_level, temperature=0.7):
     """Generates a detailed roadmap from the syllabus."""
     prompt = f"""
@@ -58,149 +239,77 @@ Your task is to generate a comprehensive roadmap that outlines the entire syllab
 **Consider the principles of chunking and scaffolding when organizing the outline. Suggest a logical sequence for the topics (Linear, Spiral, or Modular) in a separate line at the beginning, using the format:** `Sequence: <Sequence Type>` (e.g., `Sequence: Linear`).
     """
     try:
-        if prompt in generation_cache:
+        cached = get_cached_generation(prompt, scope="roadmap")
+        if cached is not None:
             st.success("Roadmap found in cache!")
-            return generation_cache[prompt]
+            return cached
         with st.spinner("Generating roadmap..."):
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                )
-            )
+            response = _llm_call(prompt, temperature=temperature, max_output_tokens=ROADMAP_MAX_OUTPUT_TOKENS)
         st.success("Roadmap generated successfully!")
-        generation_cache[prompt] = response.text.strip()
+        cache_generation(prompt, response.text.strip(), scope="roadmap")
         return response.text.strip()
     except Exception as e:
         st.error(f"Error generating roadmap: {e}")
         print(f"Error generating roadmap: {e}")  # Debugging: Print error to console
         return ""
 
+ROADMAP_MAX_DEPTH = 4  # T<n>.<n>.<n>.<n>
+
 def parse_roadmap(roadmap_text):
     """
-    Parses a roadmap string into a structured dictionary using regular expressions.
+    Parses a roadmap string (lines like "T1.2.3: Description") into a structured dictionary.
+    Uses plain string methods, which are cheaper per line than regular expressions.
     """
     roadmap = {"topics": []}
-    lines = roadmap_text.split("\n")
+    parents = {}  # Most recent node at each depth
 
-    main_topic_re = r"^T(\d+):\s*(.+)$"
-    subtopic_re = r"^T(\d+)\.(\d+):\s*(.+)$"
-    subsubtopic_re = r"^T(\d+)\.(\d+)\.(\d+):\s*(.+)$"
-    subsubsubtopic_re = r"^T(\d+)\.(\d+)\.(\d+)\.(\d+):\s*(.+)$"
-
-    current_topic = None
-    current_subtopic = None
-    current_subsubtopic = None
-    current_subsubsubtopic = None
-
-    for line in lines:
+    for line in roadmap_text.splitlines():
         line = line.strip()
         if not line:
             continue
 
-        main_match = re.match(main_topic_re, line)
-        sub_match = re.match(subtopic_re, line)
-        subsub_match = re.match(subsubtopic_re, line)
-        subsubsub_match = re.match(subsubsubtopic_re, line)
-
-        if main_match:
-            topic_num = int(main_match.group(1))
-            topic_desc = main_match.group(2)
-            current_topic = {
-                "id": f"T{topic_num}",
-                "description": topic_desc,
-                "subtopics": [],
-            }
-            roadmap["topics"].append(current_topic)
-            current_subtopic = None
-            current_subsubtopic = None
-            current_subsubsubtopic = None
-        elif sub_match:
-            topic_num = int(sub_match.group(1))
-            subtopic_num = int(sub_match.group(2))
-            subtopic_desc = sub_match.group(3)
-            current_subtopic = {
-                "id": f"T{topic_num}.{subtopic_num}",
-                "description": subtopic_desc,
-                "subsubtopics": [],
-            }
-            if current_topic:
-                current_topic["subtopics"].append(current_subtopic)
-            current_subsubtopic = None
-            current_subsubsubtopic = None
-        elif subsub_match:
-            topic_num = int(subsub_match.group(1))
-            subtopic_num = int(subsub_match.group(2))
-            subsubtopic_num = int(subsub_match.group(3))
-            subsubtopic_desc = subsub_match.group(4)
-            current_subsubtopic = {
-                "id": f"T{topic_num}.{subtopic_num}.{subsubtopic_num}",
-                "description": subsubtopic_desc,
-                "subsubsubtopics": [],
-            }
-            if current_subtopic:
-                current_subtopic["subsubtopics"].append(current_subsubtopic)
-            current_subsubsubtopic = None
-        elif subsubsub_match:
-            topic_num = int(subsubsub_match.group(1))
-            subtopic_num = int(subsubsub_match.group(2))
-            subsubtopic_num = int(subsubsub_match.group(3))
-            subsubsubtopic_num = int(subsubsub_match.group(4))
-            subsubsubtopic_desc = subsubsub_match.group(5)
-            current_subsubsubtopic = {
-                "id": f"T{topic_num}.{subtopic_num}.{subsubtopic_num}.{subsubsubtopic_num}",
-                "description": subsubsubtopic_desc,
-                "details": [],
-            }
-            if current_subsubtopic:
-                current_subsubtopic["subsubsubtopics"].append(current_subsubsubtopic)
-        else:
+        head, sep, description = line.partition(":")
+        parts = head[1:].split(".")
+        description = description.strip()
+        if (not sep or not head.startswith("T") or not description
+                or len(parts) > ROADMAP_MAX_DEPTH or not all(part.isdigit() for part in parts)):
             print(f"Warning: Could not parse line: {line}")
+            continue
 
-    return roadmap
-
-def build_prompt_with_hierarchy(subject, difficulty_level, topic_data, parent_topics_content=None, depth=1):
-    """
-    Builds a highly optimized prompt for generating lesson plan content, including hierarchical context, specific instructions to prevent repetition, and incorporating advanced learning strategies.
-    """
-    topic_details = f"**Topic:** {topic_data['id']}: {topic_data['description']}\n"
-
-    prompt = f"""
-You are an expert educator creating a detailed lesson plan for the subject: "{subject}".
-
-**Target Audience:** {difficulty_level} level students
-**Overall Objective:** To provide a comprehensive and engaging learning experience that builds a strong foundation in {subject}, ensuring students grasp both the theoretical underpinnings and practical applications of each concept.
-
+        topic_id = "T" + ".".join(str(int(part)) for part in parts)
+        depth = len(parts)
+        node = {
+            "id": topic_id,
+            "description": description,
+            "children": [],
+        }
+
+        if depth == 1:
+            roadmap["topics"].append(node)
+        elif depth - 1 in parents:
+            parents[depth - 1]["children"].append(node)
+        parents[depth] = node
+        # Deeper levels belonged to the previous branch
+        for deeper in [d for d in parents if d > depth]:
+            del parents[deeper]
 
-"""
+    return roadmap
 
-    if parent_topics_content:
-        prompt += "**Context from Parent Topics:**\n"
-        for parent_id, parent_desc in parent_topics_content.items():
-            prompt += f"  - **{parent_id}:** {parent_desc}\n"
+@st.cache_data(show_spinner=False)
+def parse_roadmap_cached(roadmap_text):
+    """Memoized parse_roadmap: reruns with an unchanged roadmap get a copy of the earlier result."""
+    return parse_roadmap(roadmap_text)
 
-    prompt += f"""
-**Current Chunk:** {topic_details}
+# Invariant instructions come first so every lesson-plan prompt shares a byte-identical
+# prefix that Gemini's prompt caching can reuse; per-topic details follow the marker.
+LESSON_PLAN_PROMPT_PREFIX = """
+You are an expert educator creating a detailed lesson plan.
 
 **Your Task:**
-Generate detailed content for this specific chunk of the lesson plan. This is a part of a larger, cohesive plan, so maintain consistency in style, tone, and depth. Ensure that the content is engaging, informative, and suitable for in-depth learning.
-
-"""
-
-    # Depth-based instructions (refined)
-    if depth == 1:
-        prompt += "**Focus:** Provide a comprehensive overview, establishing the foundational concepts and clearly outlining the subtopics. Lay the groundwork for deeper exploration in subsequent chunks.\n"
-    elif depth == 2:
-        prompt += "**Focus:** Elaborate on the key concepts introduced earlier. Provide detailed explanations, incorporating examples and analogies to enhance understanding. Ensure a smooth transition from foundational concepts to more complex ideas.\n"
-    elif depth >= 3:
-        prompt += "**Focus:** Dive deep into the intricacies of each subtopic. Provide in-depth explanations, real-world applications, and challenging scenarios. Encourage critical thinking and problem-solving skills.\n"
+Generate detailed content for the chunk of the lesson plan described after the "Chunk Details" marker below. This is a part of a larger, cohesive plan, so maintain consistency in style, tone, and depth. Ensure that the content is engaging, informative, and suitable for in-depth learning.
 
-    prompt += f"""
 **Format and Content Requirements (Strictly Adhere to):**
 
-{topic_details}
-
-
 1. **Micro-Level Learning Objectives (3-5):** VERY IMPORTANT
     -   Define SMART (Specific, Measurable, Achievable, Relevant, Time-bound) objectives for this chunk.
     -   Begin each objective with an action verb (e.g., Define, Explain, Analyze, Design, Implement).
@@ -219,62 +328,202 @@ Generate detailed content for this specific chunk of the lesson plan. This is a
 -   **No Repetition:** Refer back to concepts briefly if needed, but do not repeat detailed explanations.
 -   **Markdown Formatting:** Use markdown for formatting (headings, lists, bold, italics). No unnecessary asterisks.
 
+---
+**Chunk Details:**
 """
 
-    return prompt
+def build_prompt_with_hierarchy(subject, difficulty_level, topic_data, parent_topics_content=None, depth=1):
+    """
+    Builds a highly optimized prompt for generating lesson plan content, including hierarchical context, specific instructions to prevent repetition, and incorporating advanced learning strategies.
+    topic_data may also be a list of sibling topics, which are all listed as the current chunk.
+    """
+    siblings = topic_data if isinstance(topic_data, list) else [topic_data]
+    # Reduce the inputs to hashable tuples so identical prompts are only built once;
+    # parent order is kept because it is part of the prompt text
+    return _build_prompt_with_hierarchy(
+        subject,
+        difficulty_level,
+        tuple((sibling["id"], sibling["description"]) for sibling in siblings),
+        tuple(_truncate_ctx(parent_topics_content).items()) if parent_topics_content else (),
+        depth,
+    )
+
+@lru_cache(maxsize=4096)
+def _build_prompt_with_hierarchy(subject, difficulty_level, topics, parent_topics_content, depth):
+    """Builds the prompt from (id, description) topic pairs and (id, description) parent pairs."""
+    topic_details = "".join(f"**Topic:** {topic_id}: {description}\n" for topic_id, description in topics)
+
+    # Collect the pieces and join once instead of growing the string with +=
+    parts = [LESSON_PLAN_PROMPT_PREFIX, f"""
+**Subject:** "{subject}"
+**Target Audience:** {difficulty_level} level students
+**Overall Objective:** To provide a comprehensive and engaging learning experience that builds a strong foundation in {subject}, ensuring students grasp both the theoretical underpinnings and practical applications of each concept.
+
+"""]
+
+    if parent_topics_content:
+        parts.append("**Context from Parent Topics:**\n")
+        parts.extend(f"  - **{parent_id}:** {parent_desc}\n" for parent_id, parent_desc in parent_topics_content)
 
-def generate_lesson_plan_chunk(subject, difficulty_level, topic_data, parent_topics_content=None, depth=1, temperature=0.7):
+    parts.append(f"""
+**Current Chunk:** {topic_details}
+""")
+
+    # Depth-based instructions (refined)
+    if depth == 1:
+        parts.append("**Focus:** Provide a comprehensive overview, establishing the foundational concepts and clearly outlining the subtopics. Lay the groundwork for deeper exploration in subsequent chunks.\n")
+    elif depth == 2:
+        parts.append("**Focus:** Elaborate on the key concepts introduced earlier. Provide detailed explanations, incorporating examples and analogies to enhance understanding. Ensure a smooth transition from foundational concepts to more complex ideas.\n")
+    elif depth >= 3:
+        parts.append("**Focus:** Dive deep into the intricacies of each subtopic. Provide in-depth explanations, real-world applications, and challenging scenarios. Encourage critical thinking and problem-solving skills.\n")
+
+    return "".join(parts)
+
+async def generate_lesson_plan_chunk(subject, difficulty_level, topic_data, parent_topics_content=None, depth=1, temperature=0.7, semaphore=None):
     """
     Generates detailed content for a specific chunk of the lesson plan, using hierarchical context.
+    The optional semaphore caps how many Gemini requests are in flight at once.
     """
     prompt = build_prompt_with_hierarchy(subject, difficulty_level, topic_data, parent_topics_content, depth)
 
     try:
-        if prompt in generation_cache:
-            st.success(f"Content for {topic_data['id']} found in cache!")
-            return generation_cache[prompt]
-        with st.spinner(f"Generating content for {topic_data['id']} (Depth: {depth})..."):
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
-                    max_output_tokens=500,
-                )
+        cached = get_cached_generation(prompt, scope=topic_data["id"])
+        if cached is not None:
+            if DEBUG:
+                print(f"Content for {topic_data['id']} found in cache")
+            return cached
+        async with semaphore or asyncio.Semaphore(1):
+            response = await _llm_call_async(
+                prompt, temperature=temperature, max_output_tokens=lesson_plan_token_budget(depth)
             )
         # Convert to Markdown-like format
         markdown_content = response.text.strip()
         markdown_content = markdown_content.replace("*   ", "- ")  # Basic list conversion
 
-        generation_cache[prompt] = markdown_content
+        cache_generation(prompt, markdown_content, scope=topic_data["id"])
         return markdown_content
     except Exception as e:
         st.error(f"Error generating lesson plan chunk: {e}")
         print(f"Error generating lesson plan chunk: {e}")  # Debugging
         return ""
 
-def generate_lesson_plan_recursive(subject, roadmap, difficulty_level, temperature=0.7, parent_topics_content=None, depth=1):
+async def generate_lesson_plan_siblings_batch(subject, difficulty_level, siblings, parent_topics_content=None, depth=1, temperature=0.7, semaphore=None):
     """
-    Generates a comprehensive lesson plan recursively and returns a JSON structure, incorporating depth.
+    Generates content for several sibling chunks in a single Gemini call and returns it in sibling order.
+    Any sibling missing from the reply falls back to a call of its own.
     """
-    roadmap_dict = parse_roadmap(roadmap)
-    lesson_plan_json = {
-        "subject": subject,
-        "difficulty": difficulty_level,
-        "topics": []
+    prompt = build_prompt_with_hierarchy(subject, difficulty_level, siblings, parent_topics_content, depth)
+    prompt += """
+**Multiple Chunks:** Generate the content above separately for EACH topic listed as the current chunk.
+Respond with a JSON object of the form {"results": [{"id": "<topic id>", "content": "<markdown content>"}]} containing exactly one entry per topic, in the order listed.
+"""
+
+    results = {}
+    scope = ",".join(sibling["id"] for sibling in siblings)
+    try:
+        cached = get_cached_generation(prompt, scope=scope)
+        if cached is not None:
+            results = orjson.loads(cached)
+        else:
+            async with semaphore or asyncio.Semaphore(1):
+                response = await _llm_call_async(
+                    prompt,
+                    temperature=temperature,
+                    max_output_tokens=lesson_plan_token_budget(depth) * len(siblings),
+                    response_mime_type="application/json",
+                )
+            for item in orjson.loads(response.text)["results"]:
+                # Convert to Markdown-like format
+                results[item["id"]] = item["content"].strip().replace("*   ", "- ")  # Basic list conversion
+            cache_generation(prompt, orjson.dumps(results).decode("utf-8"), scope=scope)
+    except Exception as e:
+        st.error(f"Error generating lesson plan chunks: {e}")
+        print(f"Error generating lesson plan chunks: {e}")  # Debugging
+
+    async def content_for(sibling):
+        if sibling["id"] in results:
+            return results[sibling["id"]]
+        sibling_context = {sibling["id"]: sibling["description"]}
+        if parent_topics_content:
+            sibling_context.update(parent_topics_content)
+        return await generate_lesson_plan_chunk(
+            subject, difficulty_level, sibling, sibling_context, depth, temperature, semaphore
+        )
+
+    return await asyncio.gather(*[content_for(sibling) for sibling in siblings])
+
+async def generate_lesson_plan_siblings_json(subject, difficulty_level, siblings, temperature, parent_topics_content=None, depth=1, semaphore=None, progress=None):
+    """
+    Generates the JSON for a group of sibling topics: their own content comes from batched
+    calls of up to SIBLING_BATCH_SIZE siblings, then each sibling's subtree is generated.
+    Siblings whose whole subtree is unchanged since an earlier run are taken from the disk cache.
+    """
+    cached_subtrees = {
+        sibling["id"]: generation_cache.get(subtree_key(subject, difficulty_level, sibling, parent_topics_content, depth))
+        for sibling in siblings
     }
+    pending = [sibling for sibling in siblings if cached_subtrees[sibling["id"]] is None]
 
-    for topic in roadmap_dict["topics"]:
-        topic_json = generate_lesson_plan_chunk_json(
-            subject, difficulty_level, topic, temperature, parent_topics_content, depth
+    batches = [pending[i:i + SIBLING_BATCH_SIZE] for i in range(0, len(pending), SIBLING_BATCH_SIZE)]
+    batch_contents = await asyncio.gather(*[
+        generate_lesson_plan_siblings_batch(
+            subject, difficulty_level, batch, parent_topics_content, depth, temperature, semaphore
         )
-        lesson_plan_json["topics"].append(topic_json)
+        for batch in batches
+    ])
+    contents = {
+        sibling["id"]: content
+        for sibling, content in zip(pending, (content for batch in batch_contents for content in batch))
+    }
+
+    def count_topics(topic_json):
+        return 1 + sum(count_topics(child) for child in topic_json["children"])
+
+    async def subtree_for(sibling):
+        cached = cached_subtrees[sibling["id"]]
+        if cached is not None:
+            if DEBUG:
+                print(f"Subtree {sibling['id']} found in cache")
+            if progress:
+                for _ in range(count_topics(cached)):
+                    progress()
+            return cached
+        return await generate_lesson_plan_chunk_json(
+            subject, difficulty_level, sibling, temperature, parent_topics_content, depth, semaphore,
+            contents[sibling["id"]], progress
+        )
+
+    return await asyncio.gather(*[subtree_for(sibling) for sibling in siblings])
+
+async def generate_lesson_plan_recursive(subject, roadmap, difficulty_level, temperature=0.7, parent_topics_content=None, depth=1):
+    """
+    Generates a comprehensive lesson plan recursively and returns a JSON structure, incorporating depth.
+    Sibling topics share no data, so they are generated concurrently. A single progress bar
+    tracks the finished chunks instead of per-chunk status messages.
+    """
+    roadmap_dict = parse_roadmap_cached(roadmap)
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+    def count_topics(topics):
+        return sum(1 + count_topics(topic["children"]) for topic in topics)
+
+    chunk_done = throttled_progress(count_topics(roadmap_dict["topics"]))
 
-    return lesson_plan_json
+    topics_json = await generate_lesson_plan_siblings_json(
+        subject, difficulty_level, roadmap_dict["topics"], temperature, parent_topics_content, depth, semaphore, chunk_done
+    )
+
+    return {
+        "subject": subject,
+        "difficulty": difficulty_level,
+        "topics": list(topics_json)
+    }
 
-def generate_lesson_plan_chunk_json(subject, difficulty_level, topic_data, temperature, parent_topics_content=None, depth=1):
+async def generate_lesson_plan_chunk_json(subject, difficulty_level, topic_data, temperature, parent_topics_content=None, depth=1, semaphore=None, content_string=None, progress=None):
     """
     Recursively generates content for a topic/subtopic and returns it as a JSON object, handling depth.
-    Correctly handles arbitrary levels of nesting.
+    Correctly handles arbitrary levels of nesting. Pass content_string when the topic's own
+    content was already generated together with its siblings; progress is called once per finished topic.
     """
 
     # Build parent_topics_content for subtopics
@@ -284,50 +533,44 @@ def generate_lesson_plan_chunk_json(subject, difficulty_level, topic_data, tempe
     if parent_topics_content:
         current_level_context.update(parent_topics_content)
 
-    content_string = generate_lesson_plan_chunk(
-        subject, difficulty_level, topic_data, current_level_context, depth, temperature
-    )
+    # Children only need the parent descriptions, not its generated content
+    children_json = []
+    if topic_data["children"]:
+        children_json = await generate_lesson_plan_siblings_json(
+            subject, difficulty_level, topic_data["children"], temperature, current_level_context, depth + 1, semaphore, progress
+        )
+    if content_string is None:
+        content_string = await generate_lesson_plan_chunk(
+            subject, difficulty_level, topic_data, current_level_context, depth, temperature, semaphore
+        )
+    if progress:
+        progress()
 
     topic_json = {
         "id": topic_data["id"],
         "title": topic_data["description"],
         "content": content_string,
+        "children": list(children_json),
     }
 
-    # Check for and handle subtopics
-    if "subtopics" in topic_data and topic_data["subtopics"]:
-        topic_json["subtopics"] = []
-        for subtopic in topic_data["subtopics"]:
-            subtopic_json = generate_lesson_plan_chunk_json(
-                subject, difficulty_level, subtopic, temperature, current_level_context, depth + 1
-            )
-            topic_json["subtopics"].append(subtopic_json)
-
-    # Check for and handle subsubtopics
-    if "subsubtopics" in topic_data and topic_data["subsubtopics"]:
-        topic_json["subsubtopics"] = []
-        for subsubtopic in topic_data["subsubtopics"]:
-            subsubtopic_json = generate_lesson_plan_chunk_json(
-                subject, difficulty_level, subsubtopic, temperature, current_level_context, depth + 2
-            )
-            topic_json["subsubtopics"].append(subsubtopic_json)
-
-    # Check for and handle subsubsubtopics
-    if "subsubsubtopics" in topic_data and topic_data["subsubsubtopics"]:
-        topic_json["subsubsubtopics"] = []
-        for subsubsubtopic in topic_data["subsubsubtopics"]:
-            subsubsubtopic_json = generate_lesson_plan_chunk_json(
-                subject, difficulty_level, subsubsubtopic, temperature, current_level_context, depth + 3
-            )
-            topic_json["subsubsubtopics"].append(subsubsubtopic_json)
+    # Only complete subtrees are cached, so failed chunks are retried on the next run
+    if subtree_complete(topic_json):
+        generation_cache.set(
+            subtree_key(subject, difficulty_level, topic_data, parent_topics_content, depth),
+            topic_json,
+            expire=SUBTREE_CACHE_TTL,
+        )
 
     return topic_json
 
 def save_lesson_plan_json(lesson_plan_json, filename="lesson_plan.json"):
     """Saves the lesson plan JSON to a file."""
     try:
-        with open(filename, "w") as f:
-            json.dump(lesson_plan_json, f, indent=4)
+        # Write to a temporary file and swap it in, so a crash mid-save never leaves a partial file
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, "wb") as f:
+            f.write(orjson.dumps(lesson_plan_json, option=orjson.OPT_INDENT_2))
+        os.replace(temp_filename, filename)
         st.success(f"Lesson plan saved as {filename}")
     except Exception as e:
         st.error(f"Error saving lesson plan: {e}")
@@ -340,126 +583,130 @@ def display_lesson_plan_for_editing(lesson_plan_json):
     for topic in lesson_plan_json["topics"]:
         display_topic(topic, level=1)
 
+def store_topic_edit(topic, key):
+    """Copies an edited text area back into its topic; runs only when that text area changes."""
+    topic["content"] = st.session_state[key]
+
 def display_topic(topic, level):
     """
     Displays a single topic or subtopic using markdown headings and text areas.
+    Subtopics are only rendered once expanded, so large plans don't build every widget on each rerun.
     """
     st.markdown(f"{'#' * level} {topic['id']}: {topic['title']}")
 
-    content = st.text_area(
+    key = f"{topic['id']}_content"
+    st.text_area(
         "Content",
         value=topic["content"],
         height=300,
-        key=f"{topic['id']}_content"
+        key=key,
+        on_change=store_topic_edit,
+        args=(topic, key)
     )
-    topic["content"] = content
 
-    for subtopic in topic.get("subtopics", []):
-        display_topic(subtopic, level + 1)
+    if topic["children"] and st.checkbox(f"Show subtopics of {topic['id']}", key=f"{topic['id']}_expanded"):
+        for child in topic["children"]:
+            display_topic(child, level + 1)
+
+
+
+_HEADING_LEVELS = {'#': 1, '##': 2, '###': 3, '####': 4, '#####': 5, '######': 6}
+MARKDOWN_INLINE_RE = re.compile(r"\*\*\*(.+?)\*\*\*|\*\*(.+?)\*\*|\*(.+?)\*")  # bold-italic, bold, italic
+
+def add_markdown_runs(paragraph, text):
+    """Adds text to a DOCX paragraph as runs, applying inline bold/italic markdown in a single pass."""
+    position = 0
+    for match in MARKDOWN_INLINE_RE.finditer(text):
+        if match.start() > position:
+            paragraph.add_run(text[position:match.start()])
+        bold_italic, bold, italic = match.groups()
+        run = paragraph.add_run(bold_italic or bold or italic)
+        run.bold = bool(bold_italic or bold)
+        run.italic = bool(bold_italic or italic)
+        position = match.end()
+    if position < len(text):
+        paragraph.add_run(text[position:])
+
+def new_docx_document():
+    """Creates a Document with the shared Normal font and a single CodeBlock style for code blocks."""
+    document = Document()
+    font = document.styles['Normal'].font
+    font.name = 'Calibri'
+    font.size = Pt(12)
+
+    code_style = document.styles.add_style('CodeBlock', WD_STYLE_TYPE.PARAGRAPH)
+    code_style.font.name = 'Courier New'
+    code_style.font.size = Pt(10)
+    return document
+
+def _markdown_paragraphs_to_docx(document, text):
+    """
+    Appends markdown text to a DOCX document: headings, bullet lists, code blocks and
+    inline bold/italic. Shared by both DOCX builders.
+    """
+    add_h = document.add_heading
+    add_p = document.add_paragraph
+    code_style = document.styles['CodeBlock']
+
+    in_list = False
+    list_level = 0
+    in_code_block = False
+
+    for para in text.split('\n'):
+        para = para.strip()
 
-    for subsubtopic in topic.get("subsubtopics", []):
-        display_topic(subsubtopic, level + 2)
+        # Code blocks
+        if para.startswith("```"):
+            in_code_block = not in_code_block
+            if in_code_block:
+                # Add a paragraph for the code block
+                code_para = add_p(style=code_style)
+            continue
 
-    for subsubsubtopic in topic.get("subsubsubtopics", []):
-        display_topic(subsubsubtopic, level + 3)
+        if in_code_block:
+            code_para.add_run(para + '\n')
+            continue
 
+        # Headings
+        prefix, _, rest = para.partition(' ')
+        if prefix in _HEADING_LEVELS and rest.strip():
+            add_h(rest.strip(), _HEADING_LEVELS[prefix])
+            continue
 
+        # Lists
+        if para.startswith('- ') or para.startswith('* '):
+            if not in_list:
+                in_list = True
+                list_level = 1
+            else:
+                # Check for nested list
+                spaces = len(para) - len(para.lstrip())
+                new_level = spaces // 2 + 1
+                if new_level > list_level:
+                    list_level = new_level
+                elif new_level < list_level:
+                    list_level = new_level
+
+            list_item = para.lstrip('-* ').strip()
+            p = add_p(list_item, style='List Bullet' if list_level == 1 else f'List Bullet {list_level}')
+            if list_level > 1:
+                p.paragraph_format.left_indent = Inches(0.5 * list_level)
+            continue
+        elif in_list:
+            in_list = False
+            list_level = 0
+
+        # Bold and italics
+        if para:
+            add_markdown_runs(add_p(), para)
 
 def create_docx_from_markdown(text, filename):
     """
     Creates a DOCX file from the given text, interpreting it as Markdown and applying appropriate formatting.
     """
     try:
-        document = Document()
-        style = document.styles['Normal']
-        font = style.font
-        font.name = 'Calibri'
-        font.size = Pt(12)
-
-        # Enhanced Markdown parsing
-        paragraphs = text.split('\n')
-        in_list = False
-        list_level = 0
-        in_code_block = False
-
-        for para in paragraphs:
-            para = para.strip()
-
-            # Code blocks
-            if para.startswith("```"):
-                in_code_block = not in_code_block
-                if in_code_block:
-                    # Add a paragraph for the code block
-                    code_para = document.add_paragraph()
-                    code_para.style = document.styles.add_style(f'CodeBlock{len(document.styles)}', 1)
-                    code_para.style.font.name = 'Courier New'
-                    code_para.style.font.size = Pt(10)
-                continue
-
-            if in_code_block:
-                code_para.add_run(para + '\n')
-                continue
-
-            # Headings
-            if para.startswith('#'):
-                level = para.count('#')
-                heading_text = para.lstrip('# ').strip()
-                document.add_heading(heading_text, level=level)
-                continue
-
-            # Lists
-            if para.startswith('- ') or para.startswith('* '):
-                if not in_list:
-                    in_list = True
-                    list_level = 1
-                else:
-                    # Check for nested list
-                    spaces = len(para) - len(para.lstrip())
-                    new_level = spaces // 2 + 1
-                    if new_level > list_level:
-                        list_level = new_level
-                    elif new_level < list_level:
-                        list_level = new_level
-
-                list_item = para.lstrip('-* ').strip()
-                p = document.add_paragraph(list_item, style='List Bullet' if list_level == 1 else f'List Bullet {list_level}')
-                if list_level > 1:
-                    p.paragraph_format.left_indent = Inches(0.5 * list_level)
-                continue
-            elif in_list:
-                in_list = False
-                list_level = 0
-
-            # Bold and italics
-            while '**' in para:
-                start = para.find('**')
-                end = para.find('**', start + 2)
-                if end == -1:
-                    break
-                bold_text = para[start+2:end]
-                para = para[:start] + '<<BOLD>>' + bold_text + '<<BOLD>>' + para[end+2:]
-
-            while '*' in para:
-                start = para.find('*')
-                end = para.find('*', start + 1)
-                if end == -1:
-                    break
-                italic_text = para[start+1:end]
-                para = para[:start] + '<<ITALIC>>' + italic_text + '<<ITALIC>>' + para[end+1:]
-
-            if para:
-                p = document.add_paragraph()
-                segments = para.split('<<')
-                for segment in segments:
-                    if segment.startswith('BOLD>>'):
-                        run = p.add_run(segment[6:-6])
-                        run.bold = True
-                    elif segment.startswith('ITALIC>>'):
-                        run = p.add_run(segment[8:-8])
-                        run.italic = True
-                    else:
-                        p.add_run(segment)
-
+        document = new_docx_document()
+        _markdown_paragraphs_to_docx(document, text)
         document.save(filename)
         return filename
     except Exception as e:
@@ -470,11 +717,8 @@ def create_docx_from_markdown(text, filename):
 def create_docx_from_lesson_plan(lesson_plan_json, filename):
     """Creates a DOCX file from the lesson plan JSON."""
     try:
-        document = Document()
-        style = document.styles['Normal']
-        font = style.font
-        font.name = 'Calibri'
-        font.size = Pt(12)
+        document = new_docx_document()
+        add_h = document.add_heading
 
         def add_content(data, level):
             if isinstance(data, list):
@@ -482,27 +726,10 @@ def create_docx_from_lesson_plan(lesson_plan_json, filename):
                     add_content(item, level)
             elif isinstance(data, dict):
                 if "id" in data and "title" in data:
-                    document.add_heading(f"{data['id']}: {data['title']}", level=level)
+                    add_h(f"{data['id']}: {data['title']}", level=level)
                 if "content" in data:
-                    #document.add_paragraph(data["content"])
-                    paragraphs = data["content"].split('\n')
-                    for para in paragraphs:
-                        para = para.strip()
-                        if para.startswith('# '):
-                            document.add_heading(para[2:], level=1)
-                        elif para.startswith('## '):
-                            document.add_heading(para[3:], level=2)
-                        elif para.startswith('### '):
-                            document.add_heading(para[4:], level=3)
-                        elif para.startswith('#### '):
-                            document.add_heading(para[5:], level=4)
-                        elif para.startswith('- '):
-                            document.add_paragraph(para[2:], style='List Bullet')
-                        elif para:
-                            document.add_paragraph(para)
-                add_content(data.get("subtopics", []), level + 1)
-                add_content(data.get("subsubtopics", []), level + 2)
-                add_content(data.get("subsubsubtopics", []), level + 3)
+                    _markdown_paragraphs_to_docx(document, data["content"])
+                add_content(data["children"], level + 1)
 
         add_content(lesson_plan_json["topics"], level=2)  # Start with level 2 headings
 
@@ -513,113 +740,74 @@ def create_docx_from_lesson_plan(lesson_plan_json, filename):
         print(f"Error creating lesson plan DOCX: {e}")
         return None
 
-def extract_lesson_plan_entry(lesson_plan_json, current_id):
+def build_index(lesson_plan_json):
     """
-    Extracts the relevant section from the lesson plan JSON based on ID.
+    Walks the lesson plan once and returns an {id: node} index. The nodes are the
+    lesson plan's own dicts, so edits to them are visible through the index.
     """
-    def find_entry_recursive(data, target_id):
-        if isinstance(data, list):
-            for item in data:
-                result = find_entry_recursive(item, target_id)
-                if result:
-                    return result
-        elif isinstance(data, dict):
-            if "id" in data and data["id"] == target_id:
-                return data["content"]
-            for key, value in data.items():
-                result = find_entry_recursive(value, target_id)
-                if result:
-                    return result
-        return None
+    index = {}
+    stack = deque(lesson_plan_json["topics"])
+    while stack:
+        topic = stack.pop()
+        index[topic["id"]] = topic
+        stack.extend(topic["children"])
+    return index
+
+def get_lesson_index(lesson_plan_json):
+    """
+    Returns the id index for the lesson plan from st.session_state, rebuilding it
+    whenever a different lesson plan object is passed in.
+    """
+    cached = st.session_state.get("lesson_index")
+    if cached is None or cached[0] is not lesson_plan_json:
+        cached = (lesson_plan_json, build_index(lesson_plan_json))
+        st.session_state.lesson_index = cached
+    return cached[1]
 
-    return find_entry_recursive(lesson_plan_json, current_id)
+def extract_lesson_plan_entry(lesson_plan_json, current_id, lesson_index=None):
+    """
+    Extracts the relevant section from the lesson plan JSON based on ID.
+    Callers looking up many ids can pass the lesson_index they already hold.
+    """
+    if lesson_index is None:
+        lesson_index = get_lesson_index(lesson_plan_json)
+    entry = lesson_index.get(current_id)
+    return entry["content"] if entry else None
 
 def has_sub_chunks(lesson_plan_json, current_id):
     """
-    Checks if a given ID in the lesson plan JSON has sub-chunks
-    (subtopics, subsubtopics, etc.) at any level.
-    """
-    def find_entry_recursive(data, target_id):
-        if isinstance(data, list):
-            for item in data:
-                result = find_entry_recursive(item, target_id)
-                if result:
-                    return result
-        elif isinstance(data, dict):
-            if "id" in data and data["id"] == target_id:
-                return data
-            for key, value in data.items():
-                result = find_entry_recursive(value, target_id)
-                if result:
-                    return result
-        return None
-
-    def has_sub_keys_recursive(data):
-        if isinstance(data, list):
-            for item in data:
-                if has_sub_keys_recursive(item):
-                    return True
-        elif isinstance(data, dict):
-            if "subtopics" in data and data["subtopics"]:
-                return True
-            if "subsubtopics" in data and data["subsubtopics"]:
-                return True
-            if "subsubsubtopics" in data and data["subsubsubtopics"]:
-                return True
-            for key, value in data.items():
-                if has_sub_keys_recursive(value):
-                    return True
-        return False
-
-    entry = find_entry_recursive(lesson_plan_json["topics"], current_id)
-    if entry:
-        return has_sub_keys_recursive(entry)
-    return False
+    Checks if a given ID in the lesson plan JSON has sub-chunks.
+    """
+    entry = get_lesson_index(lesson_plan_json).get(current_id)
+    return bool(entry and entry["children"])
 
 def get_sub_chunks(lesson_plan_json, current_id):
     """
     Gets the sub-chunk IDs for a given ID.
     """
-    def find_subtopic_ids_recursive(data, target_id, found=False):
-        sub_chunks = []
-
-        if isinstance(data, list):
-            for item in data:
-                sub_chunks.extend(find_subtopic_ids_recursive(item, target_id, found))
-        elif isinstance(data, dict):
-            if "id" in data and data["id"] == target_id:
-                found = True
-
-            if found:
-                if "subtopics" in data:
-                    for subtopic in data["subtopics"]:
-                        sub_chunks.append(subtopic["id"])
-                if "subsubtopics" in data:
-                    for subsubtopic in data["subsubtopics"]:
-                        sub_chunks.append(subsubtopic["id"])
-                if "subsubsubtopics" in data:
-                    for subsubsubtopic in data["subsubsubtopics"]:
-                        sub_chunks.append(subsubsubtopic["id"])
-
-            if not found or "subtopics" in data or "subsubtopics" in data or "subsubsubtopics" in data:
-                for value in data.values():
-                    sub_chunks.extend(find_subtopic_ids_recursive(value, target_id, found))
-
-        return sub_chunks
-
-    return find_subtopic_ids_recursive(lesson_plan_json["topics"], current_id)
-
-def create_lecture_notes_prompt(lesson_plan_entry, current_id, difficulty_level, highlighted_topics, parent_topics_content=None):
-    """
-    Creates a highly optimized prompt for generating detailed lecture notes, incorporating parent topic context, specific instructions, advanced learning strategies, and addressing potential issues.
-    """
-    prompt = f"""
-You are an expert educator creating comprehensive lecture notes for the following topic:
-
-**Topic ID:** {current_id}
-**Subject:** {st.session_state.subject}
-**Target Audience:** {difficulty_level} level students
-**Overall Objective:** To deliver a deep and engaging learning experience that equips students with a thorough understanding of {st.session_state.subject}, emphasizing both the theoretical foundations and practical applications of each concept.
+    def descendant_ids(entry):
+        ids = [child["id"] for child in entry["children"]]
+        for child in entry["children"]:
+            ids.extend(descendant_ids(child))
+        return ids
+
+    entry = get_lesson_index(lesson_plan_json).get(current_id)
+    return descendant_ids(entry) if entry else []
+
+# All instruction text is sent once as the notes model's system instruction; each request
+# is a compact JSON object whose keys go from most to least shared (session, parent
+# context, current topic), so consecutive requests share a long prefix for prompt caching.
+LECTURE_NOTES_PROMPT_PREFIX = """
+You are an expert educator creating comprehensive lecture notes.
+
+**Request Format:**
+Each request is a JSON object with these keys:
+- "subject": the subject being taught.
+- "audience": the difficulty level of the target students.
+- "highlighted": topics important for numericals/examples.
+- "context": ids and titles of the current topic and its parent topics.
+- Either "topic_id" and "lesson_plan" (the topic's lesson plan content, for reference), or "topics": a list of {"topic_id", "lesson_plan"} objects.
+When "topics" is given, write the notes for each topic in the order listed and end each topic's notes with the exact marker <<<END_TOPIC:<topic_id>>>> on its own line.
 
 **Contextual Reminders:**
 - These lecture notes build upon the previously generated lesson plan.
@@ -627,22 +815,8 @@ You are an expert educator creating comprehensive lecture notes for the followin
 - Avoid repetition. Briefly reference prior concepts if needed, but focus on new material.
 - Maintain consistency in style and tone throughout the notes.
 
-"""
-
-    if parent_topics_content:
-        prompt += "**Context from Parent Topics:**\n"
-        for parent_id, parent_content in parent_topics_content.items():
-            prompt += f"  - **{parent_id}:** {parent_content}\n"
-
-    prompt += f"""
-**Lesson Plan Context (Reference):**
-{lesson_plan_entry}
-
-**Highlighted Topics (for numericals/examples):**
-{highlighted_topics}
-
 **Your Task:**
-Generate detailed lecture notes for this topic based on the provided lesson plan context. These notes should be comprehensive, engaging, and suitable for in-depth learning.
+Generate detailed lecture notes for the requested topic based on its lesson plan content. These notes should be comprehensive, engaging, and suitable for in-depth learning. The overall objective is to deliver a deep and engaging learning experience that equips students with a thorough understanding of the subject, emphasizing both the theoretical foundations and practical applications of each concept.
 
 **Incorporate the following advanced learning strategies and content requirements:**
 
@@ -663,28 +837,87 @@ Generate detailed lecture notes for this topic based on the provided lesson plan
 -   **Comprehensive:** Cover all aspects of the topic in extreme detail.
 -   **Engaging:** Use a conversational tone, ask questions, and encourage active learning.
 -   **Continuity:** Maintain a strong connection with the lesson plan and previous topics.
+"""
 
+def _lecture_notes_request(difficulty_level, highlighted_topics, parent_topics_content=None):
+    """Returns the session and parent-context fields shared by the single and batched notes requests."""
+    return {
+        "subject": st.session_state.subject,
+        "audience": difficulty_level,
+        "highlighted": highlighted_topics,
+        "context": _truncate_ctx(parent_topics_content) if parent_topics_content else {},
+    }
+
+def create_lecture_notes_prompt(lesson_plan_entry, current_id, difficulty_level, highlighted_topics, parent_topics_content=None):
     """
+    Creates the compact JSON request for one topic's lecture notes; the instructions themselves
+    are in LECTURE_NOTES_PROMPT_PREFIX, sent as the system instruction.
+    """
+    request = _lecture_notes_request(difficulty_level, highlighted_topics, parent_topics_content)
+    request["topic_id"] = current_id
+    request["lesson_plan"] = lesson_plan_entry
+    return orjson.dumps(request).decode("utf-8")
 
-    return prompt
+NOTES_TOPIC_END_RE = re.compile(r"<<<END_TOPIC:([^>]+)>>>")  # Closes each topic's section in batched notes
 
-def generate_text_from_prompt(prompt, temperature=0.8):
-    """Generates text from a prompt using the LLM."""
-    try:
-        if prompt in generation_cache:
-            st.success("Text found in cache!")
-            return generation_cache[prompt]
-        with st.spinner("Generating text..."):
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature,
+def create_lecture_notes_batch_prompt(lesson_plan_entries, difficulty_level, highlighted_topics, parent_topics_content=None):
+    """
+    Creates one JSON request for several sibling topics given as (topic_id, lesson_plan_entry)
+    pairs. Each topic's notes must end with its NOTES_TOPIC_END_RE marker so they can be split apart.
+    """
+    request = _lecture_notes_request(difficulty_level, highlighted_topics, parent_topics_content)
+    request["topics"] = [
+        {"topic_id": current_id, "lesson_plan": lesson_plan_entry}
+        for current_id, lesson_plan_entry in lesson_plan_entries
+    ]
+    return orjson.dumps(request).decode("utf-8")
+
+async def _gemini_text(prompt, system_instruction, temperature, max_output_tokens, semaphore=None):
+    """Makes one Gemini call under the optional semaphore and returns the stripped response text."""
+    # Called once per notes topic; the caller's spinner and progress bar cover the UI
+    async with semaphore or asyncio.Semaphore(1):
+        response = await _llm_call_async(
+            prompt, system_instruction,
+            temperature=temperature, max_output_tokens=max_output_tokens,
+        )
+    if DEBUG:
+        print(f"Prompt tokens served from cache: {response.usage_metadata.cached_content_token_count}")
+    return response.text.strip()
 
-                )
-            )
-        st.success("Text generated!")
-        generation_cache[prompt] = response.text.strip()
-        return response.text.strip()
+@lru_cache(maxsize=2048)
+def _call_gemini(prompt, temperature_bucket, system_instruction=None, max_output_tokens=LECTURE_NOTES_MAX_OUTPUT_TOKENS, semaphore=None):
+    """
+    Starts the Gemini call for a prompt as a task and returns it; identical prompts asked again
+    during the same script run get the same task, so they share one request. temperature_bucket
+    is the temperature in tenths, so float noise doesn't split the cache. Streamlit re-executes
+    the module on every rerun, which also starts a fresh cache for every run.
+    """
+    return asyncio.ensure_future(
+        _gemini_text(prompt, system_instruction, temperature_bucket / 10, max_output_tokens, semaphore)
+    )
+
+async def generate_text_from_prompt(prompt, temperature=0.8, semaphore=None, force_regenerate=False, system_instruction=None, max_output_tokens=LECTURE_NOTES_MAX_OUTPUT_TOKENS):
+    """
+    Generates text from a prompt using the LLM.
+    The optional semaphore caps how many Gemini requests are in flight at once. Responses are
+    cached only for temperatures up to NOTES_CACHE_MAX_TEMPERATURE; force_regenerate skips the
+    disk lookup. Hotter generations are never shared, not even within a run.
+    """
+    use_cache = temperature <= NOTES_CACHE_MAX_TEMPERATURE
+    cache_text = (system_instruction or "") + prompt  # The system instruction is part of what was asked
+    try:
+        if not use_cache:
+            return await _gemini_text(prompt, system_instruction, temperature, max_output_tokens, semaphore)
+
+        if not force_regenerate:
+            cached = get_cached_generation(cache_text)
+            if cached is not None:
+                if DEBUG:
+                    print("Text found in cache")
+                return cached
+        text = await _call_gemini(prompt, round(temperature * 10), system_instruction, max_output_tokens, semaphore)
+        cache_generation(cache_text, text, expire=NOTES_CACHE_TTL)
+        return text
     except Exception as e:
         st.error(f"Error generating text: {e}")
         print(f"Error generating text: {e}")
@@ -694,89 +927,152 @@ def format_lecture_notes_content(content, current_id):
     """Formats the generated lecture notes content."""
     return content
 
-def generate_lecture_notes_chunk(lesson_plan_json, current_id, difficulty_level, highlighted_topics, parent_topics_content=None, temperature=0.8):
+async def generate_lecture_notes_chunk(lesson_plan_json, current_id, difficulty_level, highlighted_topics, parent_topics_content=None, temperature=0.8, semaphore=None, force_regenerate=False, lesson_index=None):
     """Generates lecture notes for a specific chunk, without recursively processing sub-chunks."""
-    lesson_plan_entry = extract_lesson_plan_entry(lesson_plan_json, current_id)
+    lesson_plan_entry = extract_lesson_plan_entry(lesson_plan_json, current_id, lesson_index)
 
-    # Build parent_topics_context for subtopics
-    current_level_context = {}
-    if parent_topics_content:
-        current_level_context.update(parent_topics_content)
-
-    # Generate content for the current topic only
-    prompt = create_lecture_notes_prompt(lesson_plan_entry, current_id, difficulty_level, highlighted_topics, current_level_context)
-    generated_content = generate_text_from_prompt(prompt, temperature)
+    # Generate content for the current topic only; the context is only read, so no copy is needed
+    prompt = create_lecture_notes_prompt(lesson_plan_entry, current_id, difficulty_level, highlighted_topics, parent_topics_content)
+    generated_content = await generate_text_from_prompt(
+        prompt, temperature, semaphore, force_regenerate, system_instruction=LECTURE_NOTES_PROMPT_PREFIX
+    )
     formatted_content = format_lecture_notes_content(generated_content, current_id)
 
     return formatted_content  # Return only the content for the current topic
 
-def create_detailed_notes_recursive(lesson_plan_json, difficulty_level, highlighted_topics, temperature=0.8):
+async def generate_lecture_notes_batch(lesson_plan_json, sibling_ids, difficulty_level, highlighted_topics, parent_topics_content=None, temperature=0.8, semaphore=None, force_regenerate=False, lesson_index=None):
     """
-    Generates detailed lecture notes recursively, ensuring all topics and subtopics are covered.
+    Generates lecture notes for several sibling leaf topics in a single Gemini call and returns
+    them in sibling order. Any topic missing from the reply falls back to a call of its own.
     """
-    document_text = ""
-    processed_ids = set()  # Keep track of processed IDs to prevent duplication
+    prompt = create_lecture_notes_batch_prompt(
+        [(topic_id, extract_lesson_plan_entry(lesson_plan_json, topic_id, lesson_index)) for topic_id in sibling_ids],
+        difficulty_level, highlighted_topics, parent_topics_content,
+    )
+    generated_content = await generate_text_from_prompt(
+        prompt, temperature, semaphore, force_regenerate, system_instruction=LECTURE_NOTES_PROMPT_PREFIX,
+        max_output_tokens=min(LECTURE_NOTES_MAX_OUTPUT_TOKENS * len(sibling_ids), GEMINI_MAX_OUTPUT_TOKENS),
+    )
 
-    def count_items_recursive(data):
-        count = 0
-        if isinstance(data, list):
-            for item in data:
-                count += count_items_recursive(item)
-        elif isinstance(data, dict):
-            if "id" in data:
-                count += 1
-            for key, value in data.items():
-                if key in ["subtopics", "subsubtopics", "subsubsubtopics"]:
-                    count += count_items_recursive(value)
-        return count
-
-    total_items = count_items_recursive(lesson_plan_json["topics"])
-    item_count = 0
-    progress_bar = st.progress(0)
+    # split() alternates section, topic id, section, ...; a trailing section without a marker is dropped
+    pieces = NOTES_TOPIC_END_RE.split(generated_content)
+    results = {
+        topic_id.strip(): format_lecture_notes_content(section.strip(), topic_id.strip())
+        for section, topic_id in zip(pieces[0::2], pieces[1::2])
+    }
+
+    if lesson_index is None:
+        lesson_index = get_lesson_index(lesson_plan_json)
+
+    async def notes_for(topic_id):
+        if results.get(topic_id):
+            return results[topic_id]
+        topic_context = ChainMap({topic_id: lesson_index[topic_id]["title"]}, parent_topics_content or ChainMap())
+        return await generate_lecture_notes_chunk(
+            lesson_plan_json, topic_id, difficulty_level, highlighted_topics, topic_context, temperature, semaphore,
+            force_regenerate, lesson_index
+        )
 
-    def generate_notes_recursive(data, parent_topics_context=None):
-        nonlocal document_text, item_count
+    return await asyncio.gather(*[notes_for(topic_id) for topic_id in sibling_ids])
 
-        if isinstance(data, list):
-            for item in data:
-                generate_notes_recursive(item, parent_topics_context)
-        elif isinstance(data, dict):
-            if "id" in data:
-                topic_id = data["id"]
+async def create_detailed_notes_recursive(lesson_plan_json, difficulty_level, highlighted_topics, temperature=0.8, force_regenerate=False):
+    """
+    Generates detailed lecture notes for every topic and subtopic in the lesson plan.
+    A topic's notes only need its ancestors' titles, so every topic is generated concurrently
+    and the sections are written to the DOCX in traversal order. Sibling leaf topics are
+    generated in batches of NOTES_BATCH_SIZE per call.
+    """
+    # (topic ids, context) in document order: a single topic carries its own context,
+    # a batch of leaf siblings carries their shared parent context
+    units = []
+    processed_ids = set()  # Keep track of processed IDs to prevent duplication
 
-                if topic_id in processed_ids:
-                    return  # Skip if already processed
+    # Single pre-order walk with an explicit stack of (siblings, next index, parent context).
+    # Every node has the same {"id", "title", "content", "children"} shape, so the walk reads
+    # keys directly instead of type-checking each item.
+    stack = deque([(lesson_plan_json["topics"], 0, None)] if lesson_plan_json["topics"] else [])
+    while stack:
+        siblings, start, parent_topics_context = stack.pop()
+
+        if start == 0 and len(siblings) > 1 and all(
+            not topic["children"] and topic["id"] not in processed_ids for topic in siblings
+        ):
+            processed_ids.update(topic["id"] for topic in siblings)
+            for i in range(0, len(siblings), NOTES_BATCH_SIZE):
+                group = siblings[i:i + NOTES_BATCH_SIZE]
+                if len(group) == 1:
+                    group_context = ChainMap({group[0]["id"]: group[0]["title"]}, parent_topics_context or ChainMap())
+                else:
+                    group_context = parent_topics_context or ChainMap()
+                units.append(([topic["id"] for topic in group], group_context))
+            continue
 
-                processed_ids.add(topic_id)  # Mark this topic as processed
+        topic = siblings[start]
+        if start + 1 < len(siblings):
+            stack.append((siblings, start + 1, parent_topics_context))  # Next sibling, after this subtree
 
-                # Build parent_topics_context for subtopics
-                current_level_context = {}
-                if parent_topics_context:
-                    current_level_context.update(parent_topics_context)
-                current_level_context[topic_id] = data["title"]
+        topic_id = topic["id"]
+        if topic_id in processed_ids:
+            continue  # Skip if already processed
 
-                # Always call generate_lecture_notes_chunk for each topic
-                topic_content = generate_lecture_notes_chunk(
-                    lesson_plan_json, topic_id, difficulty_level, highlighted_topics, current_level_context, temperature
-                )
-                document_text += topic_content + "\n\n"
+        processed_ids.add(topic_id)  # Mark this topic as processed
+
+        # Extend the ancestors' context in O(1); ChainMap iterates ancestors first, like the prompt expects
+        current_level_context = ChainMap({topic_id: topic["title"]}, parent_topics_context or ChainMap())
+        units.append(([topic_id], current_level_context))
 
-                item_count += 1
-                progress_bar.progress(item_count / total_items if total_items > 0 else 1.0)
+        # Subtopics come immediately after each topic
+        if topic["children"]:
+            stack.append((topic["children"], 0, current_level_context))
 
-                # Process subtopics immediately after each topic
-                for key in ["subtopics", "subsubtopics", "subsubsubtopics"]:
-                    if key in data:
-                        generate_notes_recursive(data[key], current_level_context)
+    lesson_index = get_lesson_index(lesson_plan_json)  # Looked up once, then passed to every topic
+    advance_progress = throttled_progress(len(lesson_index))  # One notes section per unique topic id
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
 
-    generate_notes_recursive(lesson_plan_json["topics"], None)
+    async def generate_unit_notes(topic_ids, topic_context):
+        if len(topic_ids) == 1:
+            topic_contents = [await generate_lecture_notes_chunk(
+                lesson_plan_json, topic_ids[0], difficulty_level, highlighted_topics, topic_context, temperature,
+                semaphore, force_regenerate, lesson_index
+            )]
+        else:
+            topic_contents = await generate_lecture_notes_batch(
+                lesson_plan_json, topic_ids, difficulty_level, highlighted_topics, topic_context, temperature,
+                semaphore, force_regenerate, lesson_index
+            )
+        advance_progress(len(topic_ids))
+        return topic_contents
+
+    # All units run concurrently; awaiting them in traversal order lets each section go
+    # into the DOCX as soon as it and everything before it is ready, with no full-text copy
+    tasks = [
+        asyncio.create_task(generate_unit_notes(topic_ids, topic_context))
+        for topic_ids, topic_context in units
+    ]
     filename = "detailed_notes.docx"
-    if create_docx_from_markdown(document_text, filename):
-        st.success(f"Detailed notes saved as {filename}")
-        return filename
-    else:
+    try:
+        document = new_docx_document()
+        # DOCX building runs on one writer thread, which keeps the sections in submission
+        # order and leaves the event loop free to handle Gemini responses meanwhile
+        with ThreadPoolExecutor(max_workers=1) as writer_executor:
+            writes = [
+                writer_executor.submit(_markdown_paragraphs_to_docx, document, section)
+                for task in tasks
+                for section in await task
+            ]
+        for write in writes:
+            write.result()  # Re-raises any error from the writer thread
+        document.save(filename)
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        st.error(f"Error creating DOCX from Markdown: {e}")
+        print(f"Error creating DOCX from Markdown: {e}")
         return None
 
+    st.success(f"Detailed notes saved as {filename}")
+    return filename
+
 # --- Streamlit UI ---
 st.markdown("""
 <style>
@@ -799,7 +1095,7 @@ st.session_state.subject = subject
 
 st.header("Step 2: Generate and Edit Roadmap")
 if uploaded_syllabus:
-    syllabus_text = uploaded_syllabus.read().decode("utf-8")
+    syllabus_text = decode_text_file(uploaded_syllabus.getvalue())
     if st.button("Generate Roadmap"):
         roadmap = generate_roadmap(subject, syllabus_text, difficulty_level)
         st.session_state.roadmap = roadmap
@@ -821,13 +1117,14 @@ depth = st.select_slider(
 )
 if "roadmap" in st.session_state:
     if st.button("Generate Lesson Plan"):
-        with st.spinner("Generating lesson plan..."):
-            lesson_plan_json = generate_lesson_plan_recursive(
+        with st.status("Generating lesson plan...") as status:
+            lesson_plan_json = asyncio.run(generate_lesson_plan_recursive(
                 subject, st.session_state.roadmap, difficulty_level, llm_temperature_plan, None, depth
-            )
+            ))
             st.session_state.lesson_plan = lesson_plan_json
+            st.session_state.lesson_index = (lesson_plan_json, build_index(lesson_plan_json))
             save_lesson_plan_json(lesson_plan_json)
-        st.success("Lesson plan generated and saved as JSON!")
+            status.update(label="Lesson plan generated and saved as JSON!", state="complete")
 
 if "lesson_plan" in st.session_state:
     st.header("Edit Lesson Plan")
@@ -844,25 +1141,30 @@ st.header("Step 4: Generate Detailed Notes")
 highlighted_topics_input = st.text_area("Highlight topics important for numericals (comma-separated):", "")
 llm_temperature_notes = st.slider("LLM Temperature (Notes)", 0.0, 1.0, 0.8, step=0.1,
                                    help="Controls randomness of notes generation.")
+force_regenerate_notes = st.checkbox("Force regenerate", value=False,
+                                     help=f"Ignore cached notes. Notes are only cached at temperatures up to {NOTES_CACHE_MAX_TEMPERATURE}.")
 
 if "lesson_plan" in st.session_state:
     if st.button("Generate Detailed Notes"):
         highlighted_topics = [t.strip() for t in highlighted_topics_input.split(",") if t.strip()]
         with st.spinner("Generating detailed notes..."):
-            notes_filename = create_detailed_notes_recursive(
-                st.session_state.lesson_plan, difficulty_level, highlighted_topics, llm_temperature_notes
-            )
+            notes_filename = asyncio.run(create_detailed_notes_recursive(
+                st.session_state.lesson_plan, difficulty_level, highlighted_topics, llm_temperature_notes,
+                force_regenerate_notes
+            ))
             if notes_filename:  # Check if notes
                 st.session_state.notes_filename = notes_filename
+                # Read the DOCX once here instead of on every rerun that shows the download button
+                with open(notes_filename, "rb") as f:
+                    st.session_state.notes_bytes = f.read()
 
     # Download button only if notes have been generated
     if "notes_filename" in st.session_state:
-        with open(st.session_state.notes_filename, "rb") as f:
-            st.download_button(
-                label="Download Detailed Notes (DOCX)",
-                data=f,
-                file_name=st.session_state.notes_filename
-            )
+        st.download_button(
+            label="Download Detailed Notes (DOCX)",
+            data=st.session_state.notes_bytes,
+            file_name=st.session_state.notes_filename
+        )
         st.success("Detailed notes generated and ready for download!")
     elif 'lesson_plan' in st.session_state:
         st.warning("Please generate detailed notes first.")
@@ -1,11 +1,34 @@
+import sys
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 
-def hash_password(password):
-  """Hashes a password using bcrypt."""
-  hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+# Demo users, used when no username=password pairs are given on the command line
+DEMO_USERS = {
+  "john_doe": "password123",
+  "jane_smith": "securepassword",
+}
+
+def hash_password(password, salt=None):
+  """Hashes a password using bcrypt. Pass salt only for demo data; real users need their own salt."""
+  hashed = bcrypt.hashpw(password.encode('utf-8'), salt or bcrypt.gensalt())
   return hashed.decode('utf-8')  # Decode to store as string in YAML
 
-# Get hashed passwords for your users
-print("Hashed Passwords:")
-print(f"  john_doe: {hash_password('password123')}")  # Replace 'password123' with the actual password
-print(f"  jane_smith: {hash_password('securepassword')}")  # Replace 'securepassword' with the actual password
+def main(argv=None):
+  """Prints bcrypt hashes for username=password arguments (or the demo users) to paste into config.yaml."""
+  args = sys.argv[1:] if argv is None else argv
+  users = dict(arg.split("=", 1) for arg in args) if args else DEMO_USERS
+
+  # NOT FOR PRODUCTION: the demo users share one salt; real users always get a fresh salt each
+  salt = None if args else bcrypt.gensalt()
+
+  # bcrypt releases the GIL while hashing, so threads hash the users in parallel
+  with ThreadPoolExecutor() as executor:
+    hashed = dict(zip(users, executor.map(lambda password: hash_password(password, salt), users.values())))
+
+  # Get hashed passwords for your users
+  print("Hashed Passwords:")
+  for username, password_hash in hashed.items():
+    print(f"  {username}: {password_hash}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,45 @@
+import io
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+try:
+    import pymupdf  # C-backed MuPDF, much faster text extraction than pypdf
+except ImportError:
+    pymupdf = None
+
+PARALLEL_MIN_PAGES = 64  # Smaller PDFs are quicker to extract in-process
+
+
+def _extract_page_range(pdf_bytes, start, stop):
+    """Returns the non-empty page texts in [start, stop) of a PDF."""
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_texts = [doc[i].get_text("text") for i in range(start, stop)]
+    # Image-only pages yield nothing useful; drop them early
+    return [text for text in page_texts if text.strip()]
+
+
+def extract_pdf_text(pdf_bytes):
+    """Extracts the text of a PDF with PyMuPDF, then pdftotext, then pypdf as fallbacks."""
+    if pymupdf:
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            page_count = doc.page_count
+        workers = min(os.cpu_count() or 1, page_count)
+        if page_count < PARALLEL_MIN_PAGES or workers < 2:
+            page_texts = _extract_page_range(pdf_bytes, 0, page_count)
+        else:
+            # MuPDF is not thread-safe, so each page range gets its own process
+            bounds = [page_count * i // workers for i in range(workers + 1)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = executor.map(_extract_page_range, [pdf_bytes] * workers, bounds[:-1], bounds[1:])
+                page_texts = [text for chunk in chunks for text in chunk]
+        return "\n".join(page_texts)
+    if shutil.which("pdftotext"):
+        # Poppler's pdftotext is permissively licensed and far faster than pypdf
+        result = subprocess.run(["pdftotext", "-", "-"], input=pdf_bytes, capture_output=True, check=True)
+        page_texts = result.stdout.decode("utf-8", "replace").split("\f")
+        return "\n".join(text for text in page_texts if text.strip())
+    pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+    return "".join(page.extract_text() or "" for page in pdf_reader.pages)